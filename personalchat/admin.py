@@ -1,7 +1,165 @@
-from django.contrib import admin
+import json
+
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.models import CHANGE, DELETION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
 from .models import Profile, Message, Group, GroupMessage
 
-admin.site.register(Profile)
-admin.site.register(Message)
-admin.site.register(Group)
-admin.site.register(GroupMessage)
+
+# ------------------ PAGINATION ------------------
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids an exact COUNT(*) over large changelists.
+
+    On PostgreSQL, unfiltered changelists use the table's row estimate and
+    filtered ones (list_filter, date hierarchy) the planner's estimate from
+    EXPLAIN. Small results, and every other backend, get the exact count.
+    """
+
+    # Below this many estimated rows an exact count is cheap enough
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            estimate = self.estimate_rows(queryset, connection)
+            if estimate >= self.exact_count_threshold:
+                return estimate
+        return super().count
+
+    def estimate_rows(self, queryset, connection):
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                # to_regclass resolves the table through search_path, like the query itself
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+                return row[0] if row else 0
+
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+# Shared settings for the large message tables
+class MessageTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # skip the second, unfiltered COUNT(*)
+    date_hierarchy = "timestamp"
+    change_list_template = "admin/personalchat/message_table_change_list.html"  # Min/Max date hierarchy
+    ordering = ["-timestamp"]
+    list_per_page = 50
+    actions = ["delete_messages"]
+
+    def get_actions(self, request):
+        # The default action renders every selected object on its confirmation page
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    def log_bulk_action(self, request, action_flag, message):
+        # One LogEntry per action rather than per row
+        LogEntry.objects.create(
+            user_id=request.user.pk,
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_repr=message[:200],
+            action_flag=action_flag,
+            change_message=message,
+        )
+
+    def bulk_delete(self, queryset):
+        """Delete the selection without loading it: one DELETE per M2M table, then one for the rows."""
+        with transaction.atomic(using=queryset.db):
+            for field in self.model._meta.many_to_many:
+                through = field.remote_field.through
+                through.objects.filter(**{f"{field.m2m_field_name()}__in": queryset.values("pk")}).delete()
+            return queryset._raw_delete(queryset.db)
+
+    @admin.action(description="Delete selected messages", permissions=["delete"])
+    def delete_messages(self, request, queryset):
+        if request.POST.get("post"):
+            deleted = self.bulk_delete(queryset)
+            self.log_bulk_action(request, DELETION, f"Deleted {deleted} {self.opts.verbose_name_plural}.")
+            self.message_user(request, f"Deleted {deleted} rows.", messages.SUCCESS)
+            return None
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Are you sure?",
+            "opts": self.opts,
+            "media": self.media,
+            "count": queryset.count(),
+            "selected": request.POST.getlist(ACTION_CHECKBOX_NAME),
+            "select_across": request.POST.get("select_across", "0"),
+            "action_checkbox_name": ACTION_CHECKBOX_NAME,
+        }
+        return TemplateResponse(request, "admin/personalchat/delete_messages_confirmation.html", context)
+
+
+# ------------------ PROFILE ------------------
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ["user", "avatar"]
+    list_select_related = ["user"]
+    search_fields = ["user__username"]
+    autocomplete_fields = ["user"]
+
+
+# ------------------ PRIVATE MESSAGES ------------------
+@admin.register(Message)
+class MessageAdmin(MessageTableAdmin):
+    list_display = ["id", "sender", "receiver", "timestamp", "read"]
+    list_select_related = ["sender", "receiver"]
+    list_filter = ["read"]
+    raw_id_fields = ["sender", "receiver"]
+    actions = MessageTableAdmin.actions + ["mark_as_read", "mark_as_unread"]
+
+    @admin.action(description="Mark selected messages as read", permissions=["change"])
+    def mark_as_read(self, request, queryset):
+        updated = queryset.update(read=True)
+        self.log_bulk_action(request, CHANGE, f"Marked {updated} messages as read.")
+        self.message_user(request, f"Marked {updated} messages as read.", messages.SUCCESS)
+
+    @admin.action(description="Mark selected messages as unread", permissions=["change"])
+    def mark_as_unread(self, request, queryset):
+        updated = queryset.update(read=False)
+        self.log_bulk_action(request, CHANGE, f"Marked {updated} messages as unread.")
+        self.message_user(request, f"Marked {updated} messages as unread.", messages.SUCCESS)
+
+
+# ------------------ GROUPS ------------------
+@admin.register(Group)
+class GroupAdmin(admin.ModelAdmin):
+    list_display = ["id", "name", "creator", "created_at"]
+    list_select_related = ["creator"]
+    search_fields = ["name"]
+    autocomplete_fields = ["creator", "members"]
+    show_full_result_count = False
+
+
+# ------------------ GROUP MESSAGES ------------------
+@admin.register(GroupMessage)
+class GroupMessageAdmin(MessageTableAdmin):
+    list_display = ["id", "group", "sender", "timestamp"]
+    list_select_related = ["group", "sender"]
+    raw_id_fields = ["group", "sender", "read_by"]
+    actions = MessageTableAdmin.actions + ["clear_read_receipts"]
+
+    @admin.action(description="Clear read receipts on selected messages", permissions=["change"])
+    def clear_read_receipts(self, request, queryset):
+        through = GroupMessage.read_by.through
+        deleted, _ = through.objects.filter(groupmessage__in=queryset.values("pk")).delete()
+        self.log_bulk_action(request, CHANGE, f"Cleared {deleted} read receipts.")
+        self.message_user(request, f"Cleared {deleted} read receipts.", messages.SUCCESS)
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import re
+import shutil
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from .models import Attachment, AttachmentBlob, AttachmentUpload
+
+BLOCK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ChunkError(Exception):
+    pass
+
+
+def blob_storage():
+    return AttachmentBlob._meta.get_field("file").storage
+
+
+# ------------------ UPLOADS ------------------
+def partial_path(upload):
+    return blob_storage().path(os.path.join("partial", f"{upload.id}.part"))
+
+
+def parse_content_range(header, size):
+    """Parse `Content-Range: bytes start-end/total` into (start, end), end inclusive."""
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise ChunkError("Content-Range header must be 'bytes start-end/total'")
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= size:
+        raise ChunkError("Content-Range does not match the upload size")
+    return start, end
+
+
+def chunk_path(upload):
+    return blob_storage().path(os.path.join("partial", f"{upload.id}.{uuid.uuid4().hex}.chunk"))
+
+
+def receive_chunk(upload, stream, start, end):
+    """Stream one chunk from the request body into its own temporary file.
+
+    Runs without holding any lock; the chunk is spliced into the partial
+    file by `append_chunk` once the offset has been checked again.
+    """
+    path = chunk_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    expected = end - start + 1
+
+    written = 0
+    with open(path, "wb") as chunk:
+        while written < expected:
+            # DRF leaves the stream unset for an empty body
+            block = stream.read(min(BLOCK_SIZE, expected - written)) if stream is not None else b""
+            if not block:
+                break
+            chunk.write(block)
+            written += len(block)
+    if written != expected:
+        os.remove(path)
+        raise ChunkError(f"Expected {expected} bytes, received {written}")
+    return path
+
+
+def append_chunk(upload, path, start):
+    """Copy a received chunk into the partial file at `start` (local disk I/O only)."""
+    fd = os.open(partial_path(upload), os.O_WRONLY | os.O_CREAT, 0o600)
+    with os.fdopen(fd, "wb") as partial, open(path, "rb") as chunk:
+        partial.seek(start)
+        shutil.copyfileobj(chunk, partial, BLOCK_SIZE)
+        partial.truncate()
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def finish_upload(upload):
+    """Hash the completed partial file and attach it to a (possibly existing) blob.
+
+    Safe to call again: a finished upload returns its attachment, and the
+    partial file is only removed once the attachment has been committed.
+    """
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.attachment_id:
+            return Attachment.objects.select_related("blob").get(pk=upload.attachment_id)
+
+        path = partial_path(upload)
+        digest = hashlib.sha256()
+        with open(path, "rb") as partial:
+            for block in iter(lambda: partial.read(BLOCK_SIZE), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        blob = AttachmentBlob.objects.filter(sha256=sha256).first()
+        if blob is None:
+            # Content-addressed name, so a concurrent or retried upload of the same bytes is harmless
+            name = f"{sha256[:2]}/{sha256}"
+            target = blob_storage().path(name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except FileExistsError:
+                pass
+            blob, _ = AttachmentBlob.objects.get_or_create(
+                sha256=sha256, defaults={"file": name, "size": upload.size}
+            )
+
+        attachment = Attachment.objects.create(
+            owner=upload.owner,
+            blob=blob,
+            filename=upload.filename,
+            content_type=upload.content_type,
+        )
+        upload.attachment = attachment
+        upload.save(update_fields=["attachment"])
+
+    remove_file(path)
+    return attachment
+
+
+def discard_upload(upload):
+    remove_file(partial_path(upload))
+    upload.delete()
+
+
+# ------------------ DOWNLOADS ------------------
+def parse_range(header, size):
+    """Return (start, end) for a single byte range, None to send the whole file.
+
+    Raises ValueError for an unsatisfiable range. Multi-range requests are
+    answered with the full body, which RFC 9110 permits.
+    """
+    match = RANGE_RE.match(header or "")
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def iter_file_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def attachment_response(request, attachment):
+    """Build the download response, honouring ETag, Range and the sendfile setting."""
+    blob = attachment.blob
+    etag = f'"{blob.sha256}"'
+
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        response = HttpResponse(status=304)
+        response["ETag"] = etag
+        return response
+
+    sendfile = settings.ATTACHMENT_SENDFILE
+    if sendfile:
+        # The web server handles Range and streams the file itself
+        response = HttpResponse(content_type=attachment.content_type)
+        if sendfile == "x-accel-redirect":
+            response["X-Accel-Redirect"] = settings.ATTACHMENT_ACCEL_REDIRECT_PREFIX + blob.file.name
+        else:
+            response["X-Sendfile"] = blob.file.path
+    else:
+        byte_range = None
+        if_range = request.headers.get("If-Range")
+        if not if_range or if_range == etag:
+            try:
+                byte_range = parse_range(request.headers.get("Range"), blob.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{blob.size}"
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_file_range(blob.file.path, start, end),
+                status=206,
+                content_type=attachment.content_type,
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+            response["Content-Length"] = str(end - start + 1)
+        else:
+            # FileResponse uses wsgi.file_wrapper (sendfile(2)) where the server supports it
+            response = FileResponse(open(blob.file.path, "rb"), content_type=attachment.content_type)
+
+    response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    response["Content-Disposition"] = content_disposition_header(True, attachment.filename)
+    return response
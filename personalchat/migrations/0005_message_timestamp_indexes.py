@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-19 15:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalchat', '0004_remove_groupmessage_read_groupmessage_read_by'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['timestamp'], name='personalcha_timesta_ca2dc1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp'], name='personalcha_timesta_b8304c_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-19 15:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalchat', '0005_message_timestamp_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'timestamp'], name='personalcha_sender__6ffb35_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'timestamp'], name='personalcha_receive_7e1f4d_idx'),
+        ),
+    ]
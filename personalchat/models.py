@@ -1,4 +1,9 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.utils.functional import cached_property
 from django.contrib.auth.models import User
 
 # Optional: extend user for profile info
@@ -9,14 +14,78 @@ class Profile(models.Model):
     def __str__(self):
         return self.user.username
 
+# Kept outside MEDIA_ROOT so attachments are only reachable through the download view
+class AttachmentStorage(FileSystemStorage):
+    @cached_property
+    def base_location(self):
+        return settings.ATTACHMENT_ROOT
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'ATTACHMENT_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+def attachment_storage():
+    return AttachmentStorage()
+
+
+# Attachment file contents, stored once per SHA-256
+class AttachmentBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(storage=attachment_storage)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+# A user's uploaded file, pointing at deduplicated contents
+class Attachment(models.Model):
+    owner = models.ForeignKey(User, related_name='attachments', on_delete=models.CASCADE)
+    blob = models.ForeignKey(AttachmentBlob, related_name='attachments', on_delete=models.PROTECT)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, default='application/octet-stream')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.filename
+
+
+# In-progress chunked upload; the received bytes live in a partial file on disk
+class AttachmentUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='attachment_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, default='application/octet-stream')
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # Set once the upload is finished, so a retried final request can still find it
+    attachment = models.OneToOneField(Attachment, related_name='upload', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+
 # Private Messages
 class Message(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
-    content = models.TextField()
+    content = models.TextField(blank=True)
+    attachment = models.ForeignKey(Attachment, related_name='messages', on_delete=models.SET_NULL, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp']),  # admin date hierarchy / ordering
+            models.Index(fields=['sender', 'timestamp']),  # recent conversation partners
+            models.Index(fields=['receiver', 'timestamp']),
+        ]
+
     def __str__(self):
         return f'{self.sender} -> {self.receiver}'
 
@@ -38,9 +107,15 @@ class Group(models.Model):
 class GroupMessage(models.Model):
     group = models.ForeignKey(Group, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, related_name='group_messages', on_delete=models.CASCADE)
-    content = models.TextField()
+    content = models.TextField(blank=True)
+    attachment = models.ForeignKey(Attachment, related_name='group_messages', on_delete=models.SET_NULL, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     read_by = models.ManyToManyField(User, related_name='read_group_messages', blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp']),  # admin date hierarchy / ordering
+        ]
+
     def __str__(self):
         return f'{self.sender} -> {self.group.name}'
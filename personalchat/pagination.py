@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+# Cursor pagination never issues a COUNT(*), so each page is a single indexed query
+class UserDirectoryPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "username"
@@ -1,6 +1,8 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Message, Group, GroupMessage, Profile
+from django.urls import reverse
+from .models import Message, Group, GroupMessage, Profile, Attachment, AttachmentUpload
 
 # User serializer
 class UserSerializer(serializers.ModelSerializer):
@@ -12,7 +14,11 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_avatar(self, obj):
         request = self.context.get("request")
-        profile = getattr(obj, "profile", None) or Profile.objects.filter(user=obj).first()
+        # Uses the select_related profile when the view provides one
+        try:
+            profile = obj.profile
+        except Profile.DoesNotExist:
+            profile = None
         if profile and profile.avatar:
             return request.build_absolute_uri(profile.avatar.url) if request else profile.avatar.url
         return ""
@@ -32,14 +38,62 @@ class ProfileSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.avatar.url) if request else obj.avatar.url
         return ""
 
+# Attachment serializers
+class AttachmentSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(source='blob.size', read_only=True)
+    sha256 = serializers.CharField(source='blob.sha256', read_only=True)
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attachment
+        fields = ['id', 'filename', 'content_type', 'size', 'sha256', 'url']
+
+    def get_url(self, obj):
+        request = self.context.get("request")
+        url = reverse('attachment-download', args=[obj.id])
+        return request.build_absolute_uri(url) if request else url
+
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    attachment = AttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = AttachmentUpload
+        fields = ['id', 'filename', 'content_type', 'size', 'offset', 'attachment']
+        read_only_fields = ['id', 'offset']
+
+    def validate_size(self, value):
+        max_size = settings.ATTACHMENT_MAX_SIZE
+        if value < 1 or value > max_size:
+            raise serializers.ValidationError(f"Size must be between 1 and {max_size} bytes.")
+        return value
+
+
+# Only lets a sender attach files they uploaded themselves
+class OwnedAttachmentField(serializers.PrimaryKeyRelatedField):
+    def get_queryset(self):
+        request = self.context.get("request")
+        return Attachment.objects.filter(owner=request.user).select_related('blob')
+
+
+# Messages need text, an attachment, or both
+class ContentOrAttachmentMixin:
+    def validate(self, attrs):
+        if self.instance is None and not attrs.get('content') and not attrs.get('attachment'):
+            raise serializers.ValidationError("A message needs content or an attachment.")
+        return super().validate(attrs)
+
+
 # Private message serializer
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(ContentOrAttachmentMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     receiver = UserSerializer(read_only=True)
+    attachment = AttachmentSerializer(read_only=True)
+    attachment_id = OwnedAttachmentField(source='attachment', write_only=True, required=False, allow_null=True)
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'receiver', 'content', 'timestamp', 'read']
+        fields = ['id', 'sender', 'receiver', 'content', 'attachment', 'attachment_id', 'timestamp', 'read']
 
 # Group serializer
 class GroupSerializer(serializers.ModelSerializer):
@@ -50,18 +104,39 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ['id', 'name', 'members', 'created_at','creator']
 
+# Compact group listing for the bootstrap endpoint (expects annotated querysets)
+class GroupSummarySerializer(serializers.ModelSerializer):
+    member_count = serializers.IntegerField(read_only=True)
+    last_message_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'creator', 'created_at', 'member_count', 'last_message_at']
+
+
 # Group message serializer
-class GroupMessageSerializer(serializers.ModelSerializer):
+class GroupMessageSerializer(ContentOrAttachmentMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     group = serializers.PrimaryKeyRelatedField(queryset=Group.objects.all(), write_only=True)
     group_info = GroupSerializer(source='group', read_only=True)
     read_by = serializers.SerializerMethodField()  # track who read the message
+    attachment = AttachmentSerializer(read_only=True)
+    attachment_id = OwnedAttachmentField(source='attachment', write_only=True, required=False, allow_null=True)
 
     class Meta:
         model = GroupMessage
-        fields = ['id', 'group', 'group_info', 'sender', 'content', 'timestamp', 'read_by']
+        fields = ['id', 'group', 'group_info', 'sender', 'content', 'attachment', 'attachment_id', 'timestamp', 'read_by']
 
     def get_read_by(self, obj):
         # Return list of user IDs who have read this message
         return [user.id for user in obj.read_by.all()]
 
+
+# Group message without the nested group, for responses already grouped by chat
+class GroupMessageSummarySerializer(GroupMessageSerializer):
+    group = serializers.PrimaryKeyRelatedField(read_only=True)
+    group_info = None
+    attachment_id = None
+
+    class Meta(GroupMessageSerializer.Meta):
+        fields = ['id', 'group', 'sender', 'content', 'attachment', 'timestamp', 'read_by']
@@ -1,3 +1,492 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import files
+from .admin import EstimatedCountPaginator
+from .models import AttachmentBlob, AttachmentUpload, Message, Group, GroupMessage, Profile
+
+
+# ------------------ ADMIN ------------------
+class MessageAdminTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser("root", "root@example.com", "pw")
+        self.bob = User.objects.create_user("bob", password="pw")
+        self.client.force_login(self.admin_user)
+
+        self.group = Group.objects.create(name="team", creator=self.admin_user)
+        self.group.members.add(self.admin_user, self.bob)
+        self.group_msgs = [
+            GroupMessage.objects.create(group=self.group, sender=self.admin_user, content=str(i))
+            for i in range(3)
+        ]
+        for msg in self.group_msgs:
+            msg.read_by.add(self.bob)
+
+    def post_action(self, model_name, action, **extra):
+        data = {"action": action, "_selected_action": [self.group_msgs[0].pk], "select_across": "1", **extra}
+        return self.client.post(f"/admin/personalchat/{model_name}/", data)
+
+    def test_delete_asks_for_confirmation_with_count(self):
+        response = self.post_action("groupmessage", "delete_messages")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "permanently delete 3 group messages")
+        self.assertEqual(GroupMessage.objects.count(), 3)
+
+    def test_delete_runs_set_based_statements_and_logs(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post_action("groupmessage", "delete_messages", post="yes")
+
+        self.assertEqual(GroupMessage.objects.count(), 0)
+        self.assertEqual(GroupMessage.read_by.through.objects.count(), 0)
+        deletes = [q["sql"] for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 2)
+        # The rows themselves are never loaded into Python
+        self.assertFalse(any('"personalchat_groupmessage"."content"' in q["sql"] for q in queries))
+        entry = LogEntry.objects.get(action_flag=DELETION)
+        self.assertEqual(entry.change_message, "Deleted 3 group messages.")
+
+    def test_mark_as_read_updates_selection(self):
+        msg = Message.objects.create(sender=self.admin_user, receiver=self.bob, content="hi")
+
+        self.client.post("/admin/personalchat/message/", {"action": "mark_as_read", "_selected_action": [msg.pk]})
+
+        msg.refresh_from_db()
+        self.assertTrue(msg.read)
+
+    def test_date_hierarchy_avoids_distinct_scan(self):
+        GroupMessage.objects.filter(pk=self.group_msgs[0].pk).update(
+            timestamp=datetime(2023, 5, 1, tzinfo=dt_timezone.utc)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/personalchat/groupmessage/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "timestamp__year=2023")
+        self.assertContains(response, "timestamp__year=2024")  # generated between Min and Max
+        self.assertContains(response, f"timestamp__year={timezone.now().year}")
+        self.assertFalse(any("DISTINCT" in q["sql"] for q in queries))
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    def fetchone(self):
+        return self.row
+
+
+class EstimatedCountPaginatorTests(SimpleTestCase):
+    def connection(self, row):
+        cursor = FakeCursor(row)
+        connection = mock.Mock(vendor="postgresql", cursor=lambda: cursor)
+        connection.ops.quote_name = lambda name: f'"{name}"'
+        return connection, cursor
+
+    def test_unfiltered_uses_schema_resolved_table_estimate(self):
+        connection, cursor = self.connection((5_000_000,))
+        paginator = EstimatedCountPaginator(Message.objects.order_by("-timestamp"), 50)
+
+        self.assertEqual(paginator.estimate_rows(Message.objects.all(), connection), 5_000_000)
+        self.assertIn("to_regclass", cursor.executed[0])
+
+    def test_filtered_uses_planner_estimate(self):
+        connection, cursor = self.connection(('[{"Plan": {"Plan Rows": 1234567}}]',))
+        queryset = Message.objects.filter(read=False).order_by("-timestamp")
+        paginator = EstimatedCountPaginator(queryset, 50)
+
+        self.assertEqual(paginator.estimate_rows(queryset, connection), 1234567)
+        self.assertTrue(cursor.executed[0].startswith("EXPLAIN (FORMAT JSON) SELECT"))
+
+    def test_large_estimate_replaces_exact_count(self):
+        connection, _ = self.connection(('[{"Plan": {"Plan Rows": 1234567}}]',))
+        paginator = EstimatedCountPaginator(Message.objects.filter(read=False).order_by("-timestamp"), 50)
+
+        with mock.patch("personalchat.admin.connections", {"default": connection}):
+            self.assertEqual(paginator.count, 1234567)
+
+
+# ------------------ USER DIRECTORY ------------------
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user("me")
+        self.users = [User.objects.create_user(f"al{i:02d}") for i in range(30)]
+        User.objects.create_user("zed")
+        Profile.objects.create(user=self.users[0], avatar="avatars/a.png")
+        Message.objects.create(sender=self.me, receiver=self.users[25], content="hi")
+        Message.objects.create(sender=self.users[3], receiver=self.me, content="hey")
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def usernames(self, data):
+        return [user["username"] for user in data["results"]]
+
+    def test_prefix_search_is_paginated_and_excludes_caller(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/users/", {"search": "al"}).json()
+
+        self.assertEqual(len(data["results"]), 20)
+        self.assertTrue(all(name.startswith("al") for name in self.usernames(data)))
+        self.assertNotIn("me", self.usernames(data))
+        self.assertTrue(data["results"][0]["avatar"].endswith("a.png"))
+
+        data = self.client.get("/api/users/", {"search": "z"}).json()
+        self.assertEqual(self.usernames(data), ["zed"])
+
+    def test_recent_partners_first_and_only_once(self):
+        with self.assertNumQueries(4):
+            first = self.client.get("/api/users/", {"search": "al", "recent": "1"}).json()
+
+        names = self.usernames(first)
+        self.assertEqual(names[:2], ["al03", "al25"])
+        self.assertEqual(len(names), 22)
+
+        with self.assertNumQueries(3):
+            second = self.client.get(first["next"]).json()
+        rest = self.usernames(second)
+        self.assertNotIn("al03", rest)
+        self.assertNotIn("al25", rest)
+        self.assertEqual(sorted(names + rest), [f"al{i:02d}" for i in range(30)])
+
+
+    def test_chatty_partner_does_not_hide_others(self):
+        chatty = self.users[10]
+        for i in range(60):
+            Message.objects.create(sender=self.me, receiver=chatty, content=f"out{i}")
+            Message.objects.create(sender=chatty, receiver=self.me, content=f"in{i}")
+
+        names = self.usernames(self.client.get("/api/users/", {"search": "al", "recent": "1"}).json())
+
+        self.assertEqual(names[:3], ["al10", "al03", "al25"])
+        self.assertEqual(len(names), 23)
+
+# ------------------ ATTACHMENTS ------------------
+class RangeParsingTests(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(files.parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(files.parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(files.parse_range("bytes=50-500", 100), (50, 99))
+        self.assertEqual(files.parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(files.parse_range("bytes=-500", 100), (0, 99))
+
+    def test_parse_range_ignored(self):
+        self.assertIsNone(files.parse_range(None, 100))
+        self.assertIsNone(files.parse_range("bytes=-", 100))
+        self.assertIsNone(files.parse_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(files.parse_range("items=0-1", 100))
+
+    def test_parse_range_unsatisfiable(self):
+        for header in ["bytes=-0", "bytes=100-", "bytes=150-200", "bytes=9-5"]:
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                files.parse_range(header, 100)
+
+    def test_parse_content_range(self):
+        self.assertEqual(files.parse_content_range("bytes 0-9/100", 100), (0, 9))
+        self.assertEqual(files.parse_content_range("bytes 99-99/100", 100), (99, 99))
+        for header in [None, "bytes 0-9/*", "bytes 0-9/50", "bytes 9-0/100", "bytes 0-100/100"]:
+            with self.subTest(header=header), self.assertRaises(files.ChunkError):
+                files.parse_content_range(header, 100)
+
+
+class AttachmentTests(TestCase):
+    data = bytes(range(256)) * 40
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        override = self.settings(ATTACHMENT_ROOT=root, ATTACHMENT_MAX_CHUNK_SIZE=4096)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.eve = User.objects.create_user("eve")
+        self.clients = {}
+        for user in [self.alice, self.bob, self.eve]:
+            self.clients[user.username] = APIClient()
+            self.clients[user.username].force_authenticate(user)
+
+    def start(self, client, size=None):
+        response = client.post("/api/attachments/uploads/", {
+            "filename": "notes.bin", "content_type": "application/pdf", "size": size or len(self.data),
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def put(self, client, upload_id, start, end, body=None, **extra):
+        body = self.data[start:end + 1] if body is None else body
+        return client.put(
+            f"/api/attachments/uploads/{upload_id}/", body, content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.data)}", **extra,
+        )
+
+    def upload(self, client):
+        upload_id = self.start(client)
+        for start in range(0, len(self.data), 4096):
+            response = self.put(client, upload_id, start, min(start + 4095, len(self.data) - 1))
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_upload_resume_and_download_round_trip(self):
+        client = self.clients["alice"]
+        upload_id = self.start(client)
+
+        self.assertEqual(self.put(client, upload_id, 0, 4095).json()["offset"], 4096)
+        # A replayed chunk conflicts and reports where to resume
+        conflict = self.put(client, upload_id, 0, 4095)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()["offset"], 4096)
+        self.assertEqual(client.get(f"/api/attachments/uploads/{upload_id}/")["Upload-Offset"], "4096")
+
+        self.put(client, upload_id, 4096, 8191)
+        final = self.put(client, upload_id, 8192, len(self.data) - 1)
+        self.assertEqual(final.status_code, 201)
+        attachment = final.json()
+        self.assertEqual(attachment["size"], len(self.data))
+        self.assertEqual(attachment["sha256"], hashlib.sha256(self.data).hexdigest())
+
+        # The final response can be lost: retrying or polling still yields the attachment
+        self.assertEqual(self.put(client, upload_id, 8192, len(self.data) - 1).json()["id"], attachment["id"])
+        status_data = client.get(f"/api/attachments/uploads/{upload_id}/").json()
+        self.assertEqual(status_data["attachment"]["id"], attachment["id"])
+
+        response = client.get(attachment["url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertEqual(response["ETag"], f'"{attachment["sha256"]}"')
+
+    def test_chunk_validation(self):
+        client = self.clients["alice"]
+        upload_id = self.start(client)
+
+        self.assertEqual(self.put(client, upload_id, 0, 9, body=b"").status_code, 411)
+        self.assertEqual(self.put(client, upload_id, 0, 9, body=b"", CONTENT_LENGTH="0").status_code, 400)
+        self.assertEqual(self.put(client, upload_id, 0, 9, body=b"short").status_code, 400)
+        self.assertEqual(self.put(client, upload_id, 0, 9999).status_code, 413)
+        self.assertEqual(client.get(f"/api/attachments/uploads/{upload_id}/").json()["offset"], 0)
+
+        # DRF hands over no stream at all for an empty body
+        upload = AttachmentUpload.objects.get(pk=upload_id)
+        with self.assertRaises(files.ChunkError):
+            files.receive_chunk(upload, None, 0, 9)
+
+    def test_failed_finalization_can_be_retried(self):
+        client = self.clients["alice"]
+        upload_id = self.start(client, size=4096)
+        self.data = self.data[:4096]
+
+        with mock.patch.object(files.AttachmentBlob.objects, "get_or_create", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.put(client, upload_id, 0, 4095)
+
+        response = self.put(client, upload_id, 0, 4095)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["size"], 4096)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.upload(self.clients["alice"])
+        second = self.upload(self.clients["bob"])
+
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(AttachmentBlob.objects.count(), 1)
+
+    def test_range_and_conditional_downloads(self):
+        client = self.clients["alice"]
+        attachment = self.upload(client)
+        url = attachment["url"]
+
+        partial = client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial["Content-Range"], f"bytes 10-19/{len(self.data)}")
+        self.assertEqual(b"".join(partial.streaming_content), self.data[10:20])
+
+        suffix = client.get(url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(suffix.streaming_content), self.data[-5:])
+
+        self.assertEqual(client.get(url, HTTP_RANGE=f"bytes={len(self.data)}-").status_code, 416)
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=partial["ETag"]).status_code, 304)
+        # A stale If-Range falls back to the full body
+        stale = client.get(url, HTTP_RANGE="bytes=0-0", HTTP_IF_RANGE='"other"')
+        self.assertEqual(stale.status_code, 200)
+
+    def test_sendfile_mode_hands_off_to_web_server(self):
+        attachment = self.upload(self.clients["alice"])
+
+        with self.settings(ATTACHMENT_SENDFILE="x-accel-redirect"):
+            response = self.clients["alice"].get(attachment["url"])
+
+        sha256 = attachment["sha256"]
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-attachments/{sha256[:2]}/{sha256}")
+        self.assertEqual(response.content, b"")
+
+    def test_download_access(self):
+        attachment = self.upload(self.clients["alice"])
+        url = attachment["url"]
+        self.assertEqual(self.clients["bob"].get(url).status_code, 404)
+
+        sent = self.clients["alice"].post(
+            "/api/messages/", {"receiver": self.bob.id, "attachment_id": attachment["id"]}, format="json"
+        )
+        self.assertEqual(sent.status_code, 201)
+        self.assertEqual(self.clients["bob"].get(url).status_code, 200)
+        self.assertEqual(self.clients["eve"].get(url).status_code, 404)
+
+    def test_cannot_send_someone_elses_attachment(self):
+        attachment = self.upload(self.clients["alice"])
+
+        response = self.clients["eve"].post(
+            "/api/messages/", {"receiver": self.alice.id, "attachment_id": attachment["id"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+# ------------------ BOOTSTRAP ------------------
+class BootstrapTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user("me")
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def add_chats(self, count):
+        for i in range(count):
+            other = User.objects.create_user(f"user{User.objects.count()}")
+            Profile.objects.create(user=other, avatar="avatars/a.png")
+            Message.objects.create(sender=self.me, receiver=other, content="hi")
+            Message.objects.create(sender=other, receiver=self.me, content="hello")
+            group = Group.objects.create(name=f"group{i}", creator=self.me)
+            group.members.add(self.me, other)
+            msg = GroupMessage.objects.create(group=group, sender=other, content="hey")
+            msg.read_by.add(other)
+
+    def test_query_count_does_not_grow_with_chats(self):
+        self.add_chats(2)
+        with self.assertNumQueries(9):
+            small = self.client.get("/api/bootstrap/").json()
+
+        self.add_chats(13)
+        with self.assertNumQueries(9):
+            large = self.client.get("/api/bootstrap/").json()
+
+        self.assertEqual(len(small["conversations"]), 2)
+        self.assertEqual(len(large["conversations"]), 10)
+        self.assertEqual(len(large["groups"]), 15)
+        self.assertEqual(sum("messages" in group for group in large["groups"]), 10)
+        self.assertEqual(large["profile"]["username"], "me")
+
+    def test_conversation_page_and_unread(self):
+        self.add_chats(1)
+        other = User.objects.exclude(pk=self.me.pk).get()
+        for i in range(25):
+            Message.objects.create(sender=other, receiver=self.me, content=f"m{i}")
+
+        data = self.client.get("/api/bootstrap/").json()
+
+        conversation = data["conversations"][0]
+        self.assertEqual(conversation["user"]["id"], other.id)
+        self.assertEqual(len(conversation["messages"]), 20)
+        self.assertEqual(conversation["messages"][-1]["content"], "m24")
+        self.assertTrue(conversation["has_more"])
+        self.assertEqual(conversation["unread"], 26)
+        self.assertEqual(data["unread_counts"], {str(other.id): 26})
+        self.assertEqual(list(data["group_unread_counts"].values()), [1])
+        # Bootstrap only previews; nothing is marked as read
+        self.assertEqual(Message.objects.filter(read=True).count(), 0)
+
+    def test_sync_token_returns_only_new_chats(self):
+        self.add_chats(3)
+        token = self.client.get("/api/bootstrap/").json()["sync_token"]
+        earlier = timezone.now() - timedelta(minutes=1)
+        Message.objects.update(timestamp=earlier)
+        GroupMessage.objects.update(timestamp=earlier)
+
+        other = User.objects.get(username="user1")
+        Message.objects.create(sender=other, receiver=self.me, content="new")
+        data = self.client.get("/api/bootstrap/", {"since": token}).json()
+
+        self.assertFalse(data["full"])
+        self.assertEqual(len(data["conversations"]), 1)
+        self.assertEqual([m["content"] for m in data["conversations"][0]["messages"]], ["new"])
+        self.assertFalse(any("messages" in group for group in data["groups"]))
+        self.assertEqual(len(data["groups"]), 3)
+
+    def test_invalid_sync_tokens_are_rejected(self):
+        token = self.client.get("/api/bootstrap/").json()["sync_token"]
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user("stranger"))
+
+        self.assertEqual(stranger.get("/api/bootstrap/", {"since": token}).status_code, 400)
+        self.assertEqual(self.client.get("/api/bootstrap/", {"since": "junk"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/bootstrap/", {"since": token + "x"}).status_code, 400)
+
+    def test_full_page_without_older_messages_has_no_more(self):
+        self.add_chats(1)
+        other = User.objects.exclude(pk=self.me.pk).get()
+        group = Group.objects.get()
+        for i in range(18):
+            Message.objects.create(sender=other, receiver=self.me, content=f"m{i}")
+        for i in range(19):
+            GroupMessage.objects.create(group=group, sender=other, content=f"g{i}")
+
+        data = self.client.get("/api/bootstrap/").json()
+
+        conversation = data["conversations"][0]
+        self.assertEqual(len(conversation["messages"]), 20)
+        self.assertFalse(conversation["has_more"])
+        self.assertEqual(len(data["groups"][0]["messages"]), 20)
+        self.assertFalse(data["groups"][0]["has_more"])
+
+    def test_chatty_partner_does_not_hide_other_conversations(self):
+        self.add_chats(5)
+        chatty = User.objects.get(username="user1")
+        for i in range(60):
+            Message.objects.create(sender=self.me, receiver=chatty, content=f"out{i}")
+            Message.objects.create(sender=chatty, receiver=self.me, content=f"in{i}")
+
+        data = self.client.get("/api/bootstrap/").json()
+
+        self.assertEqual(len(data["conversations"]), 5)
+        self.assertEqual(data["conversations"][0]["user"]["username"], "user1")
+        self.assertTrue(all(conversation["unread"] for conversation in data["conversations"]))
+
+    def test_sync_reports_when_changed_chats_were_left_out(self):
+        self.add_chats(15)
+        token = self.client.get("/api/bootstrap/").json()["sync_token"]
+        Message.objects.update(timestamp=timezone.now() - timedelta(minutes=1))
+        GroupMessage.objects.update(timestamp=timezone.now() - timedelta(minutes=1))
+
+        for other in User.objects.exclude(pk=self.me.pk):
+            Message.objects.create(sender=other, receiver=self.me, content="new")
+        data = self.client.get("/api/bootstrap/", {"since": token}).json()
+
+        self.assertEqual(len(data["conversations"]), 10)
+        self.assertFalse(data["complete"])
+
+        token = data["sync_token"]
+        Message.objects.update(timestamp=timezone.now() - timedelta(minutes=1))
+        Message.objects.create(sender=User.objects.get(username="user1"), receiver=self.me, content="one")
+        data = self.client.get("/api/bootstrap/", {"since": token}).json()
+        self.assertTrue(data["complete"])
+        self.assertEqual(len(data["conversations"]), 1)
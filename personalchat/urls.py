@@ -3,6 +3,9 @@ from rest_framework.routers import DefaultRouter
 
 from .views import (
     UpdateAvatarView,
+    AttachmentUploadView,
+    AttachmentUploadDetailView,
+    AttachmentDownloadView,
     UserViewSet,
     MessageViewSet,
     GroupViewSet,
@@ -12,6 +15,7 @@ from .views import (
     register_user,
     login_user,
     unread_counts,
+    bootstrap,
 )
 
 router = DefaultRouter()
@@ -26,6 +30,10 @@ urlpatterns = [
     path('api/login/', login_user, name='login_user'),
    
     path('api/profile/avatar/', UpdateAvatarView.as_view(), name='update_avatar'),
+    path('api/attachments/uploads/', AttachmentUploadView.as_view(), name='attachment-upload'),
+    path('api/attachments/uploads/<uuid:upload_id>/', AttachmentUploadDetailView.as_view(), name='attachment-upload-detail'),
+    path('api/attachments/<int:pk>/download/', AttachmentDownloadView.as_view(), name='attachment-download'),
+    path('api/bootstrap/', bootstrap, name='bootstrap'),
     path('api/messages/unread_counts/', unread_counts, name='unread-counts'),
     path('api/group-messages/unread_counts/', group_unread_counts, name='group-unread-counts'),
     #path('test-profile/', test_profile_api, name='test_profile_api'),
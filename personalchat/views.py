@@ -1,25 +1,101 @@
+from datetime import timedelta
+
 from rest_framework import viewsets, permissions, status, serializers
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from .models import Message, Group, GroupMessage, Profile
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Q, Subquery, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.shortcuts import get_object_or_404
+from .models import Message, Group, GroupMessage, Profile, Attachment, AttachmentUpload
 from .serializers import (
     UserSerializer,
     MessageSerializer,
     GroupSerializer,
     GroupMessageSerializer,
-    ProfileSerializer
+    ProfileSerializer,
+    AttachmentSerializer,
+    AttachmentUploadSerializer,
+    GroupSummarySerializer,
+    GroupMessageSummarySerializer,
 )
+from . import files
+from .pagination import UserDirectoryPagination
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
 
 # ------------------ USER ------------------
+RECENT_PARTNER_LIMIT = 10
+
+
+def recent_partner_ids(user, limit=RECENT_PARTNER_LIMIT, since=None):
+    """Return ids of the users `user` last exchanged private messages with, newest first.
+
+    With `since`, only partners with messages newer than that time are returned.
+    """
+    sent = Message.objects.filter(sender=user)
+    received = Message.objects.filter(receiver=user)
+    if since:
+        sent = sent.filter(timestamp__gt=since)
+        received = received.filter(timestamp__gt=since)
+
+    # Latest message per partner on each side, served by the
+    # (sender, timestamp) and (receiver, timestamp) indexes
+    sent = sent.values("receiver").annotate(last=Max("timestamp")).order_by("-last")[:limit]
+    received = received.values("sender").annotate(last=Max("timestamp")).order_by("-last")[:limit]
+
+    last_seen = {}
+    for partner_id, last in [*((row["receiver"], row["last"]) for row in sent),
+                             *((row["sender"], row["last"]) for row in received)]:
+        if partner_id != user.id and (partner_id not in last_seen or last > last_seen[partner_id]):
+            last_seen[partner_id] = last
+    return sorted(last_seen, key=last_seen.get, reverse=True)[:limit]
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserDirectoryPagination
+
+    def get_queryset(self):
+        qs = User.objects.select_related("profile")
+        if self.action != "list":
+            return qs
+
+        # Directory: everyone but the caller, optionally narrowed by username prefix.
+        # startswith is served by the username index (varchar_pattern_ops on PostgreSQL).
+        qs = qs.exclude(id=self.request.user.id)
+        search = self.request.query_params.get("search", "").strip()
+        if search:
+            qs = qs.filter(username__startswith=search)
+        return qs
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get("recent") not in ("1", "true"):
+            return super().list(request, *args, **kwargs)
+
+        # Rank recent conversation partners first; they are left out of the
+        # alphabetical pages so each user appears exactly once.
+        partner_ids = recent_partner_ids(request.user)
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(queryset.exclude(id__in=partner_ids))
+
+        recent = []
+        if partner_ids and not request.query_params.get(self.paginator.cursor_query_param):
+            partners = {user.id: user for user in queryset.filter(id__in=partner_ids)}
+            recent = [partners[pk] for pk in partner_ids if pk in partners]
+
+        serializer = self.get_serializer(recent + list(page), many=True)
+        return self.get_paginated_response(serializer.data)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -78,7 +154,7 @@ def login_user(request):
 
 # ------------------ PRIVATE MESSAGES ------------------
 class MessageViewSet(viewsets.ModelViewSet):
-    queryset = Message.objects.all().order_by("-timestamp")
+    queryset = Message.objects.select_related("attachment__blob").order_by("-timestamp")
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -96,7 +172,7 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         msgs = Message.objects.filter(sender__id=request.user.id, receiver__id=other_user_id) | \
                Message.objects.filter(sender__id=other_user_id, receiver__id=request.user.id)
-        msgs = msgs.order_by("timestamp")
+        msgs = msgs.select_related("attachment__blob").order_by("timestamp")
 
         msgs.filter(receiver=request.user, read=False).update(read=True)
 
@@ -105,18 +181,28 @@ class MessageViewSet(viewsets.ModelViewSet):
 
 
 # ------------------ UNREAD COUNTS ------------------
+def private_unread_map(user):
+    """Unread private messages per sender id, in a single GROUP BY query."""
+    rows = Message.objects.filter(receiver=user, read=False) \
+        .values("sender_id").annotate(count=Count("id"))
+    return {row["sender_id"]: row["count"] for row in rows}
+
+
+def group_unread_map(user):
+    """Unread group messages per group id, in a single GROUP BY query.
+
+    Groups without unread messages are omitted.
+    """
+    rows = GroupMessage.objects.filter(group__members=user) \
+        .exclude(sender=user).exclude(read_by=user) \
+        .values("group_id").annotate(count=Count("id"))
+    return {row["group_id"]: row["count"] for row in rows}
+
+
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def unread_counts(request):
-    user = request.user
-    private_msgs = Message.objects.filter(receiver=user, read=False)
-
-    unread_data = {}
-    for msg in private_msgs:
-        sender_id = msg.sender.id
-        unread_data[sender_id] = unread_data.get(sender_id, 0) + 1
-
-    return Response(unread_data)
+    return Response(private_unread_map(request.user))
 
 
 # ------------------ GROUPS ------------------
@@ -194,14 +280,15 @@ class GroupViewSet(viewsets.ModelViewSet):
 
 # ------------------ GROUP MESSAGES ------------------
 class GroupMessageViewSet(viewsets.ModelViewSet):
-    queryset = GroupMessage.objects.all().order_by("timestamp")
+    queryset = GroupMessage.objects.select_related("attachment__blob").order_by("timestamp")
     serializer_class = GroupMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         group_id = self.request.query_params.get("group_id")
         if group_id:
-            qs = GroupMessage.objects.filter(group__id=group_id).order_by("timestamp")
+            qs = GroupMessage.objects.filter(group__id=group_id) \
+                .select_related("attachment__blob").order_by("timestamp")
 
             # Mark unread messages as read for current user safely
             unread_msgs = qs.exclude(sender=self.request.user).exclude(read_by=self.request.user)
@@ -243,15 +330,251 @@ class UpdateAvatarView(APIView):
         return Response({"avatar": avatar_url}, status=status.HTTP_200_OK)
 
 
+# ------------------ ATTACHMENTS ------------------
+# Start a resumable upload: POST {filename, content_type, size}
+class AttachmentUploadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = AttachmentUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(owner=request.user)
+        return Response(AttachmentUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+# Query progress (GET), send a chunk (PUT with Content-Range) or cancel (DELETE)
+class AttachmentUploadDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        return get_object_or_404(AttachmentUpload, id=upload_id, owner=request.user)
+
+    def progress_response(self, request, upload):
+        serializer = AttachmentUploadSerializer(upload, context={"request": request})
+        return Response(serializer.data, headers={"Upload-Offset": str(upload.offset)})
+
+    def finish_response(self, request, upload):
+        attachment = files.finish_upload(upload)
+        serializer = AttachmentSerializer(attachment, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def get(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload(request, upload_id)
+        if upload.offset == upload.size and not upload.attachment_id:
+            # A previous finalization failed; retry it
+            files.finish_upload(upload)
+            upload.refresh_from_db()
+        return self.progress_response(request, upload)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload(request, upload_id)
+        if upload.offset == upload.size:
+            # Retried final chunk: return the (possibly newly finished) attachment
+            return self.finish_response(request, upload)
+
+        try:
+            start, end = files.parse_content_range(request.headers.get("Content-Range"), upload.size)
+        except files.ChunkError as exc:
+            return Response({"error": str(exc), "offset": upload.offset}, status=status.HTTP_400_BAD_REQUEST)
+        length = end - start + 1
+        if length > settings.ATTACHMENT_MAX_CHUNK_SIZE:
+            return Response({"error": f"Chunks may be at most {settings.ATTACHMENT_MAX_CHUNK_SIZE} bytes"},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        content_length = request.META.get("CONTENT_LENGTH")
+        if not content_length:
+            return Response({"error": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+        if content_length != str(length):
+            return Response({"error": "Content-Length does not match Content-Range"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if start != upload.offset:
+            return Response({"error": "Chunk does not start at the current offset", "offset": upload.offset},
+                            status=status.HTTP_409_CONFLICT)
+
+        # The body is read straight from the request stream, never through request.data,
+        # and without holding the row lock while the client sends it
+        try:
+            chunk = files.receive_chunk(upload, request.stream, start, end)
+        except files.ChunkError as exc:
+            return Response({"error": str(exc), "offset": upload.offset}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                upload = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+                if start != upload.offset:
+                    return Response({"error": "Chunk does not start at the current offset", "offset": upload.offset},
+                                    status=status.HTTP_409_CONFLICT)
+                files.append_chunk(upload, chunk, start)
+                upload.offset = end + 1
+                upload.save(update_fields=["offset"])
+        finally:
+            files.remove_file(chunk)
+
+        if upload.offset < upload.size:
+            return self.progress_response(request, upload)
+        return self.finish_response(request, upload)
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        files.discard_upload(self.get_upload(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AttachmentDownloadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        user = request.user
+        # Visible to the uploader and to anyone who can see a message carrying it
+        visible = Q(owner=user) | Q(messages__sender=user) | Q(messages__receiver=user) | \
+            Q(group_messages__group__members=user)
+        attachment_ids = Attachment.objects.filter(visible, id=pk).values("id")
+        attachment = get_object_or_404(Attachment.objects.select_related("blob"), id__in=attachment_ids)
+        return files.attachment_response(request, attachment)
+
+
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def group_unread_counts(request):
     user = request.user
-    groups = Group.objects.filter(members=user)
-    unread_data = {}
-    for group in groups:
-        count = GroupMessage.objects.filter(
-            group=group
-        ).exclude(sender=user).exclude(read_by=user).count()  # only per-user unread
-        unread_data[group.id] = count
-    return Response(unread_data)
+    unread = group_unread_map(user)  # only per-user unread
+    group_ids = Group.objects.filter(members=user).values_list("id", flat=True)
+    return Response({group_id: unread.get(group_id, 0) for group_id in group_ids})
+
+
+# ------------------ BOOTSTRAP ------------------
+BOOTSTRAP_CHAT_LIMIT = 10   # chats whose latest messages are included
+BOOTSTRAP_PAGE_SIZE = 20    # messages per chat
+SYNC_TOKEN_SALT = "personalchat.bootstrap"
+# Messages saved while a response is being built may carry an earlier timestamp,
+# so the next sync starts slightly before this one; clients dedupe by message id.
+SYNC_TOKEN_OVERLAP = timedelta(seconds=5)
+
+
+def latest_per_partition(queryset, partition, size=BOOTSTRAP_PAGE_SIZE):
+    """Keep the newest `size` + 1 rows of each partition, in one windowed query.
+
+    The extra row only tells whether older messages exist; see `split_page`.
+    """
+    return queryset.annotate(
+        row_number=Window(RowNumber(), partition_by=[partition], order_by=F("timestamp").desc())
+    ).filter(row_number__lte=size + 1).order_by("-timestamp")
+
+
+def split_page(rows, size=BOOTSTRAP_PAGE_SIZE):
+    """Return (page oldest first, has_more) from rows fetched newest first."""
+    return rows[:size][::-1], len(rows) > size
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def bootstrap(request):
+    """Everything the client needs at launch, in a fixed number of queries.
+
+    Pass the previous response's `sync_token` as `?since=` to only receive
+    chats with new messages. Profile, groups and unread counts are always
+    returned in full. A sync covers at most BOOTSTRAP_CHAT_LIMIT changed
+    chats of each kind; if more changed, `complete` is false and the client
+    should bootstrap again without `since`.
+    """
+    user = request.user
+    since = None
+    token = request.query_params.get("since")
+    if token:
+        try:
+            payload = signing.loads(token, salt=SYNC_TOKEN_SALT)
+        except signing.BadSignature:
+            payload = {}
+        if payload.get("user") != user.id:
+            return Response({"error": "Invalid sync token"}, status=status.HTTP_400_BAD_REQUEST)
+        since = parse_datetime(payload["time"])
+    synced_at = timezone.now()
+    context = {"request": request}
+
+    me = User.objects.select_related("profile").get(pk=user.pk)
+    unread = private_unread_map(user)
+    group_unread = group_unread_map(user)
+
+    # Private conversations: newest page of each recent partner's chat
+    partner_ids = recent_partner_ids(user, BOOTSTRAP_CHAT_LIMIT + 1, since=since)
+    truncated = len(partner_ids) > BOOTSTRAP_CHAT_LIMIT
+    partner_ids = partner_ids[:BOOTSTRAP_CHAT_LIMIT]
+    pages = {partner_id: [] for partner_id in partner_ids}
+    if partner_ids:
+        partner = Case(When(sender=user, then=F("receiver")), default=F("sender"))
+        msgs = Message.objects.filter(
+            Q(sender=user, receiver__in=partner_ids) | Q(receiver=user, sender__in=partner_ids)
+        )
+        if since:
+            msgs = msgs.filter(timestamp__gt=since)
+        msgs = latest_per_partition(msgs.annotate(partner_id=partner), partner) \
+            .select_related("sender__profile", "receiver__profile", "attachment__blob")
+        for msg in msgs:
+            pages[msg.partner_id].append(msg)
+
+    conversations = []
+    for partner_id, rows in pages.items():
+        if not rows:
+            continue
+        other = rows[0].sender if rows[0].sender_id == partner_id else rows[0].receiver
+        page, has_more = split_page(rows)
+        conversations.append({
+            "user": UserSerializer(other, context=context).data,
+            "unread": unread.get(partner_id, 0),
+            "last_message_at": rows[0].timestamp,
+            "messages": MessageSerializer(page, many=True, context=context).data,
+            "has_more": has_more,
+        })
+
+    # Groups: all of them summarized, plus the newest page of the most active ones
+    last_message = GroupMessage.objects.filter(group=OuterRef("pk")).order_by("-timestamp")
+    member_count = Group.members.through.objects.filter(group=OuterRef("pk")) \
+        .values("group").annotate(count=Count("*")).values("count")
+    groups = list(
+        Group.objects.filter(members=user)
+        .annotate(
+            member_count=Subquery(member_count),
+            last_message_at=Subquery(last_message.values("timestamp")[:1]),
+        )
+        .order_by(F("last_message_at").desc(nulls_last=True), "-created_at")
+    )
+
+    active_ids = [
+        group.id for group in groups
+        if group.last_message_at and (since is None or group.last_message_at > since)
+    ]
+    truncated = truncated or len(active_ids) > BOOTSTRAP_CHAT_LIMIT
+    active_ids = active_ids[:BOOTSTRAP_CHAT_LIMIT]
+    group_pages = {group_id: [] for group_id in active_ids}
+    if active_ids:
+        group_msgs = GroupMessage.objects.filter(group_id__in=active_ids)
+        if since:
+            group_msgs = group_msgs.filter(timestamp__gt=since)
+        group_msgs = latest_per_partition(group_msgs, F("group")) \
+            .select_related("sender__profile", "attachment__blob") \
+            .prefetch_related(Prefetch("read_by", queryset=User.objects.only("id")))
+        for msg in group_msgs:
+            group_pages[msg.group_id].append(msg)
+
+    group_data = []
+    for group, summary in zip(groups, GroupSummarySerializer(groups, many=True).data):
+        summary["unread"] = group_unread.get(group.id, 0)
+        rows = group_pages.get(group.id)
+        if rows:
+            page, summary["has_more"] = split_page(rows)
+            summary["messages"] = GroupMessageSummarySerializer(page, many=True, context=context).data
+        group_data.append(summary)
+
+    sync_token = signing.dumps(
+        {"user": user.id, "time": (synced_at - SYNC_TOKEN_OVERLAP).isoformat()},
+        salt=SYNC_TOKEN_SALT,
+    )
+    return Response({
+        "profile": UserSerializer(me, context=context).data,
+        "conversations": conversations,
+        "groups": group_data,
+        "unread_counts": unread,
+        "group_unread_counts": {group.id: group_unread.get(group.id, 0) for group in groups},
+        "full": since is None,
+        # Only a sync can be incomplete; a full bootstrap is a preview of the latest chats
+        "complete": since is None or not truncated,
+        "sync_token": sync_token,
+    })
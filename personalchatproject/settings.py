@@ -103,3 +103,12 @@ import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# Message attachments (served only through the download view)
+ATTACHMENT_ROOT = os.path.join(BASE_DIR, 'private_media')
+ATTACHMENT_MAX_SIZE = 100 * 1024 * 1024
+ATTACHMENT_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# None serves files from Django; 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache)
+# hands the transfer to the web server.
+ATTACHMENT_SENDFILE = None
+ATTACHMENT_ACCEL_REDIRECT_PREFIX = '/protected-attachments/'